@@ -1,18 +1,46 @@
-import fitz
 import os
-import json
 import re
-from collections import defaultdict
+import functools
+import heapq
+from multiprocessing import Pool
 
 INPUT_DIR = "/app/input"
 OUTPUT_DIR = "/app/output"
 
-def extract_title_from_pdf(pdf_path):
+# Heading patterns, fused into one alternation compiled once at module load
+_HEADING_COMBINED = re.compile(
+    r'^(?:'
+    r'\d+\.?\s+'  # Numbered headings (1. , 2.1 )
+    r'|[A-Z][a-z]+'  # Capitalized words
+    r'|[A-Z\s]+$'  # All caps
+    r'|(?:Chapter|Section|Part|Appendix)'  # Common heading words
+    r')'
+)
+_WS_RE = re.compile(r'\s+')
+
+@functools.lru_cache(maxsize=None)
+def _text_flags():
+    """
+    Text extraction flags for span-level analysis. Image blocks are skipped
+    anyway, so don't have MuPDF decode and copy their pixel data. Computed
+    once, on first use.
+    """
+    import fitz
+    return fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+@functools.lru_cache(maxsize=256)
+def _is_bold_font(font_name):
+    """
+    Check whether a font name denotes a bold face. Cached per font name,
+    since a PDF only uses a handful of distinct fonts.
+    """
+    return "bold" in font_name.lower()
+
+def extract_title_from_doc(doc, page_dicts=None):
     """
     Extract the document title from PDF metadata or first page content.
+    The first page's text dict is stored in page_dicts for reuse.
     """
-    doc = fitz.open(pdf_path)
-    
     # Try to get title from metadata first
     metadata = doc.metadata
     if metadata.get("title") and metadata["title"].strip():
@@ -22,15 +50,28 @@ def extract_title_from_pdf(pdf_path):
     if len(doc) > 0:
         page = doc[0]
         # Get text blocks and find the largest/first text that looks like a title
-        text_dict = page.get_text("dict")
+        text_dict = page.get_text("dict", flags=_text_flags())
+        # Keep it for the outline pass so page 0 isn't parsed twice
+        if page_dicts is not None:
+            page_dicts[0] = text_dict
         
-        title_candidates = []
+        # Single pass: track the top-most substantial line and the top-most
+        # line overall as ((y_pos, -font_size), text), instead of collecting
+        # and sorting every candidate on the page
+        best = None
+        first = None
         
         for block in text_dict["blocks"]:
             if block["type"] != 0:  # Skip image blocks
                 continue
                 
             for line in block["lines"]:
+                y_pos = line["bbox"][1]  # y-position for ordering
+                
+                # Lines below the best title so far can never replace it
+                if best is not None and y_pos > best[0][0]:
+                    continue
+                
                 line_text = ""
                 max_font_size = 0
                 
@@ -42,85 +83,76 @@ def extract_title_from_pdf(pdf_path):
                 
                 line_text = line_text.strip()
                 if line_text and len(line_text) > 3:  # Avoid single characters
-                    title_candidates.append({
-                        "text": line_text,
-                        "font_size": max_font_size,
-                        "y_pos": line["bbox"][1]  # y-position for ordering
-                    })
-        
-        # Sort by y-position (top to bottom) and font size
-        title_candidates.sort(key=lambda x: (x["y_pos"], -x["font_size"]))
+                    # Order by y-position (top to bottom), then font size
+                    key = (y_pos, -max_font_size)
+                    if first is None or key < first[0]:
+                        first = (key, line_text)
+                    if len(line_text) >= 10 and (best is None or key < best[0]):  # Reasonable title length
+                        best = (key, line_text)
         
         # Return the first substantial text (likely the title)
-        for candidate in title_candidates:
-            if len(candidate["text"]) >= 10:  # Reasonable title length
-                return candidate["text"]
+        if best is not None:
+            return best[1]
         
         # If no good candidate, return the first text found
-        if title_candidates:
-            return title_candidates[0]["text"]
+        if first is not None:
+            return first[1]
     
-    doc.close()
     return "Untitled Document"
 
-def detect_heading_levels(spans_data):
+@functools.lru_cache(maxsize=256)
+def _extract_title_cached(pdf_path, mtime_ns, size):
     """
-    Analyze font sizes and formatting to determine heading levels.
+    Open a PDF and extract its title. mtime_ns and size only serve as
+    part of the cache key, so a modified file is parsed again.
     """
-    # Collect all font sizes
-    font_sizes = []
-    for span_info in spans_data:
-        if span_info["font_size"]:
-            font_sizes.append(span_info["font_size"])
+    import fitz
+    
+    with fitz.open(pdf_path) as doc:
+        return extract_title_from_doc(doc)
+
+def extract_title_from_pdf(pdf_path):
+    """
+    Open a PDF and extract its title, reusing the result while the file
+    is unchanged.
+    """
+    stat = os.stat(pdf_path)
+    return _extract_title_cached(pdf_path, stat.st_mtime_ns, stat.st_size)
+
+def detect_heading_levels(sizes):
+    """
+    Analyze the font sizes of all spans to determine heading levels.
+    """
+    # Collect all non-zero font sizes
+    font_sizes = [size for size in sizes if size]
     
     if not font_sizes:
         return {}
     
-    # Get unique font sizes sorted in descending order
-    unique_sizes = sorted(set(font_sizes), reverse=True)
+    # Get the largest unique font sizes in descending order (max 6 heading
+    # levels), without sorting every distinct size in the document
+    unique_sizes = heapq.nlargest(6, set(font_sizes))
     
-    # Map font sizes to heading levels
-    level_mapping = {}
-    for i, size in enumerate(unique_sizes[:6]):  # Max 6 heading levels
-        if i == 0:
-            level_mapping[size] = "H1"
-        elif i == 1:
-            level_mapping[size] = "H2" 
-        elif i == 2:
-            level_mapping[size] = "H3"
-        elif i == 3:
-            level_mapping[size] = "H4"
-        elif i == 4:
-            level_mapping[size] = "H5"
-        else:
-            level_mapping[size] = "H6"
+    # Map font sizes to heading levels (largest size is H1)
+    level_mapping = {size: f"H{i + 1}" for i, size in enumerate(unique_sizes)}
     
     return level_mapping
 
 def is_likely_heading(text, font_size, is_bold, level_mapping):
     """
     Determine if a text span is likely a heading based on various criteria.
+    Expects text to be already stripped.
     """
     # Check if font size corresponds to a heading level
     if font_size in level_mapping:
         # Additional criteria for headings
-        text = text.strip()
-        
         # Length criteria (headings are usually shorter)
         if len(text) > 200:
             return False
             
         # Pattern matching for common heading patterns
-        heading_patterns = [
-            r'^\d+\.?\s+',  # Numbered headings (1. , 2.1 )
-            r'^[A-Z][a-z]+',  # Capitalized words
-            r'^[A-Z\s]+$',  # All caps
-            r'^(Chapter|Section|Part|Appendix)',  # Common heading words
-        ]
-        
-        for pattern in heading_patterns:
-            if re.match(pattern, text):
-                return True
+        if _HEADING_COMBINED.match(text):
+            return True
                 
         # If bold and reasonable length, likely a heading
         if is_bold and 5 <= len(text) <= 100:
@@ -131,12 +163,11 @@ def is_likely_heading(text, font_size, is_bold, level_mapping):
     
     return False
 
-def extract_outline_from_pdf(pdf_path):
+def extract_outline_from_doc(doc, page_dicts=None):
     """
     Extract document outline/headings from PDF.
+    Page text dicts already in page_dicts are reused instead of re-extracted.
     """
-    doc = fitz.open(pdf_path)
-    
     # First, try to get outline from PDF bookmarks/TOC
     toc = doc.get_toc()
     if toc:
@@ -154,17 +185,23 @@ def extract_outline_from_pdf(pdf_path):
                 "text": title.strip(),
                 "page": page_num
             })
-        doc.close()
         return outline
     
-    # Fallback: extract from text analysis
-    spans_data = []
+    # Fallback: extract from text analysis, keeping span attributes in
+    # parallel lists rather than a dict per span
+    texts = []
+    sizes = []
+    bolds = []
+    pages = []
     
     for page_num in range(len(doc)):
         page = doc[page_num]
         
-        # Get text with formatting information
-        text_dict = page.get_text("dict")
+        # Get text with formatting information, reusing the dict from the
+        # title pass if there is one
+        text_dict = page_dicts.pop(page_num, None) if page_dicts else None
+        if text_dict is None:
+            text_dict = page.get_text("dict", flags=_text_flags())
         
         for block in text_dict["blocks"]:
             if block["type"] != 0:  # Skip image blocks
@@ -176,47 +213,36 @@ def extract_outline_from_pdf(pdf_path):
                     if not text:
                         continue
                         
-                    spans_data.append({
-                        "text": text,
-                        "font_size": span["size"],
-                        "font_name": span["font"],
-                        "bold": "Bold" in span["font"] or "bold" in span["font"].lower(),
-                        "page": page_num + 1,
-                        "y_pos": span["bbox"][1]
-                    })
-    
-    doc.close()
+                    texts.append(text)
+                    sizes.append(span["size"])
+                    bolds.append(_is_bold_font(span["font"]))
+                    pages.append(page_num + 1)
     
     # Detect heading levels based on font sizes
-    level_mapping = detect_heading_levels(spans_data)
+    level_mapping = detect_heading_levels(sizes)
     
     # Extract headings
     outline = []
     seen_headings = set()  # To avoid duplicates
     
-    for span_info in spans_data:
-        if is_likely_heading(
-            span_info["text"], 
-            span_info["font_size"], 
-            span_info["bold"], 
-            level_mapping
-        ):
-            text = span_info["text"].strip()
+    for i in range(len(texts)):
+        if is_likely_heading(texts[i], sizes[i], bolds[i], level_mapping):
+            text = texts[i]
             
             # Avoid duplicate headings
-            heading_key = (text.lower(), span_info["page"])
+            heading_key = (text.lower(), pages[i])
             if heading_key in seen_headings:
                 continue
             seen_headings.add(heading_key)
             
             # Clean up heading text
-            text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
+            text = _WS_RE.sub(' ', text)  # Normalize whitespace
             
             if len(text) >= 3:  # Minimum heading length
                 outline.append({
-                    "level": level_mapping[span_info["font_size"]],
+                    "level": level_mapping[sizes[i]],
                     "text": text,
-                    "page": span_info["page"]
+                    "page": pages[i]
                 })
     
     # Sort outline by page number and y-position
@@ -224,16 +250,45 @@ def extract_outline_from_pdf(pdf_path):
     
     return outline
 
+@functools.lru_cache(maxsize=256)
+def _extract_outline_cached(pdf_path, mtime_ns, size):
+    """
+    Open a PDF and extract its outline. mtime_ns and size only serve as
+    part of the cache key, so a modified file is parsed again.
+    """
+    import fitz
+    
+    with fitz.open(pdf_path) as doc:
+        return extract_outline_from_doc(doc)
+
+def extract_outline_from_pdf(pdf_path):
+    """
+    Open a PDF and extract its outline, reusing the result while the file
+    is unchanged.
+    """
+    stat = os.stat(pdf_path)
+    outline = _extract_outline_cached(pdf_path, stat.st_mtime_ns, stat.st_size)
+    # Copy so callers can't modify the cached outline
+    return [dict(item) for item in outline]
+
 def process_single_pdf(pdf_path, output_path):
     """
     Process a single PDF and generate JSON output according to schema.
     """
+    print(f"Processing: {os.path.basename(pdf_path)}")
+    
+    import fitz
+    import orjson
+    
     try:
-        # Extract title
-        title = extract_title_from_pdf(pdf_path)
-        
-        # Extract outline
-        outline = extract_outline_from_pdf(pdf_path)
+        # Open the PDF once and share the handle between both passes
+        page_dicts = {}
+        with fitz.open(pdf_path) as doc:
+            # Extract title
+            title = extract_title_from_doc(doc, page_dicts)
+            
+            # Extract outline
+            outline = extract_outline_from_doc(doc, page_dicts)
         
         # Create output according to schema
         output_data = {
@@ -241,9 +296,9 @@ def process_single_pdf(pdf_path, output_path):
             "outline": outline
         }
         
-        # Write JSON output
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
+        # Write JSON output (orjson emits UTF-8 with 2-space indentation)
+        with open(output_path, "wb") as f:
+            f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
             
         return True
         
@@ -256,8 +311,8 @@ def process_single_pdf(pdf_path, output_path):
             "outline": []
         }
         
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(error_output, f, indent=2, ensure_ascii=False)
+        with open(output_path, "wb") as f:
+            f.write(orjson.dumps(error_output, option=orjson.OPT_INDENT_2))
             
         return False
 
@@ -267,24 +322,24 @@ def process_all_pdfs(input_dir, output_dir):
     """
     os.makedirs(output_dir, exist_ok=True)
     
-    processed_count = 0
-    error_count = 0
-    
-    for filename in os.listdir(input_dir):
-        if not filename.lower().endswith(".pdf"):
-            continue
+    tasks = []
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(".pdf"):
+                continue
 
-        pdf_path = os.path.join(input_dir, filename)
-        output_path = os.path.join(output_dir, filename.replace(".pdf", ".json"))
-        
-        print(f"Processing: {filename}")
-        
-        success = process_single_pdf(pdf_path, output_path)
-        
-        if success:
-            processed_count += 1
-        else:
-            error_count += 1
+            pdf_path = entry.path
+            output_path = os.path.join(output_dir, entry.name[:-4] + ".json")
+            tasks.append((pdf_path, output_path))
+    
+    # PDFs are independent, so process them in separate worker processes
+    # (capped at 4 workers; more gave no further speedup)
+    num_workers = min(os.cpu_count() or 1, 4)
+    with Pool(num_workers) as pool:
+        results = pool.starmap(process_single_pdf, tasks)
+    
+    processed_count = sum(1 for success in results if success)
+    error_count = len(results) - processed_count
     
     print(f"Processing complete. Success: {processed_count}, Errors: {error_count}")
 